@@ -0,0 +1,40 @@
+import os
+
+# Gunicorn settings for the container (picked up automatically from the working directory)
+bind = f"0.0.0.0:{os.getenv('PORT', '7860')}"
+worker_class = "uvicorn_worker.UvicornWorker"
+
+
+def _usable_cpus() -> int:
+    # CPUs this process may run on; os.cpu_count() reports every core on the host
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# Each worker loads its own model and opens its own DB pool, so keep the default low
+MAX_DEFAULT_WORKERS = 2
+workers = int(os.getenv("WEB_CONCURRENCY", min(_usable_cpus(), MAX_DEFAULT_WORKERS)))
+
+# Postgres connections all workers together may hold (Supabase's session-mode pooler has a
+# small client limit). Split evenly into each worker's pool; workers inherit this env.
+DB_CONNECTION_BUDGET = int(os.getenv("DB_CONNECTION_BUDGET", "10"))
+if DB_CONNECTION_BUDGET < 1:
+    raise SystemExit("DB_CONNECTION_BUDGET must be at least 1")
+if workers > DB_CONNECTION_BUDGET:
+    # Every worker needs at least one connection; more workers would overrun the budget
+    print(
+        f"WEB_CONCURRENCY={workers} exceeds DB_CONNECTION_BUDGET={DB_CONNECTION_BUDGET}; "
+        f"running {DB_CONNECTION_BUDGET} workers"
+    )
+    workers = DB_CONNECTION_BUDGET
+_pool_max = max(1, DB_CONNECTION_BUDGET // workers)
+_pool_max = min(_pool_max, int(os.getenv("DB_POOL_MAX_SIZE", _pool_max)))
+os.environ["DB_POOL_MAX_SIZE"] = str(_pool_max)
+os.environ["DB_POOL_MIN_SIZE"] = str(min(_pool_max, int(os.getenv("DB_POOL_MIN_SIZE", "2"))))
+
+# Reuse idle connections from the front-end proxy instead of reconnecting per request
+keepalive = 65
+timeout = 60
+graceful_timeout = 30
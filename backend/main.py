@@ -1,33 +1,92 @@
+import asyncio
+import functools
+import hashlib
+import logging
 import os
+import queue
+import re
 import threading
 import random
 import time
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
 
 import psycopg
-from psycopg_pool import ConnectionPool
-from fastapi import FastAPI, HTTPException, Depends
+from psycopg.types.json import set_json_loads
+from psycopg.types.numeric import FloatLoader
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+from fastapi import FastAPI, HTTPException, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from dotenv import load_dotenv
 import joblib
 import numpy as np
+import orjson
+import redis.asyncio as aioredis
 
 # --------------------------------------------------
 # ENV
 # --------------------------------------------------
 load_dotenv()
 
+# Outside the app's lifetime (import, tooling, teardown) records go straight to the stream.
+# While it runs, lifespan swaps in a QueueHandler so log calls on the event loop only enqueue
+# and a listener thread does the writes.
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
+_log_queue = queue.SimpleQueue()
+_log_queue_handler = QueueHandler(_log_queue)
+
+log = logging.getLogger("stockapi")
+log.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+log.addHandler(_log_stream)
+log.propagate = False
+
+
+def _start_log_listener() -> QueueListener:
+    listener = QueueListener(_log_queue, _log_stream)
+    listener.start()
+    log.addHandler(_log_queue_handler)
+    log.removeHandler(_log_stream)
+    return listener
+
+
+def _stop_log_listener(listener: QueueListener) -> None:
+    # Swap back first so nothing is queued after the listener drains and exits
+    log.addHandler(_log_stream)
+    log.removeHandler(_log_queue_handler)
+    listener.stop()
+
 DATABASE_URL = os.getenv("DATABASE_URL")
 FRONTEND_URL = os.getenv("FRONTEND_URL", "").rstrip("/")
 
+# Executions before psycopg prepares a query server-side. Set to "none" when
+# DATABASE_URL points at a transaction-mode pooler (e.g. PgBouncer < 1.21).
+_prepare_threshold = os.getenv("DB_PREPARE_THRESHOLD", "5").strip().lower()
+DB_PREPARE_THRESHOLD = None if _prepare_threshold in ("", "none") else int(_prepare_threshold)
+# Hot lookups skip the threshold and are prepared on their first run on each connection
+PREPARE_HOT = DB_PREPARE_THRESHOLD is not None
+
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+# Seconds a request waits for a free connection before getting a 503
+DB_POOL_TIMEOUT_SEC = float(os.getenv("DB_POOL_TIMEOUT_SEC", "5"))
+
+# Optional cache shared by every worker/instance; unset to use only the in-process cache
+REDIS_URL = os.getenv("REDIS_URL")
+# Redis is only a cache: give up quickly and fall back to Postgres rather than stall a request
+REDIS_TIMEOUT_SEC = float(os.getenv("REDIS_TIMEOUT_SEC", "0.25"))
+
 if not DATABASE_URL:
     raise RuntimeError("DATABASE_URL is required")
 
 # --------------------------------------------------
 # DATABASE POOL (RENDER SAFE)
 # --------------------------------------------------
-pool: ConnectionPool | None = None
+pool: AsyncConnectionPool | None = None
+_pool_lock = asyncio.Lock()
 
 
 def _normalize_dsn(dsn: str) -> str:
@@ -36,29 +95,89 @@ def _normalize_dsn(dsn: str) -> str:
     return dsn
 
 
-def get_pool() -> ConnectionPool:
+async def _configure_connection(conn: psycopg.AsyncConnection) -> None:
+    # Price columns are NUMERIC: load them as float rather than Decimal
+    conn.adapters.register_loader("numeric", FloatLoader)
+    set_json_loads(orjson.loads, conn)
+
+
+async def get_pool() -> AsyncConnectionPool:
     global pool
     if pool is None or pool.closed:
-        pool = ConnectionPool(
-            conninfo=_normalize_dsn(DATABASE_URL),
-            min_size=1,
-            max_size=10,
-            kwargs={"prepare_threshold": None},
-        )
-        print("✓ Database pool initialized")
+        async with _pool_lock:
+            if pool is None or pool.closed:
+                pool = AsyncConnectionPool(
+                    conninfo=_normalize_dsn(DATABASE_URL),
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    timeout=DB_POOL_TIMEOUT_SEC,
+                    kwargs={"prepare_threshold": DB_PREPARE_THRESHOLD},
+                    configure=_configure_connection,
+                    open=False,
+                )
+                await pool.open()
+                log.info("✓ Database pool initialized")
     return pool
 
 
-def get_db_connection():
-    pool = get_pool()
-    with pool.connection() as conn:
+@asynccontextmanager
+async def db_connection():
+    pool = await get_pool()
+    async with pool.connection() as conn:
+        yield conn
+
+
+async def run_query(query):
+    # Pre-ping without the extra round trip: a connection the pooler dropped while idle only
+    # fails on first use. The pool discards it on return and the read is retried once.
+    async with db_connection() as conn:
+        try:
+            return await query(conn)
+        except psycopg.OperationalError:
+            if not conn.broken:
+                raise
+            log.warning("Database connection lost; retrying on a fresh connection")
+    async with db_connection() as conn:
+        return await query(conn)
+
+
+async def get_db_connection():
+    async with db_connection() as conn:
         yield conn
 
 
 # --------------------------------------------------
 # FASTAPI APP
 # --------------------------------------------------
-app = FastAPI(title="Stock Predictor API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log_listener = _start_log_listener()
+    # Open the pool before traffic arrives so the first request skips TCP/TLS/auth setup
+    try:
+        await (await get_pool()).wait(timeout=10)
+    except Exception as e:
+        log.warning("⚠️ Database pool warm-up failed: %s", e)
+    # First predict allocates the booster's prediction buffers; pay that before traffic
+    if model is not None:
+        try:
+            await asyncio.to_thread(_predict_row, dict.fromkeys(FEATURE_COLUMNS, 0.0))
+        except Exception as e:
+            log.warning("⚠️ Model warm-up failed: %s", e)
+    refresher = asyncio.create_task(_refresh_live_cache())
+    yield
+    refresher.cancel()
+    if pool is not None:
+        await pool.close()
+    if redis_client is not None:
+        await redis_client.aclose()
+    _stop_log_listener(log_listener)
+
+
+app = FastAPI(
+    title="Stock Predictor API",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
 
 ALLOWED_ORIGINS = [
     "http://localhost:5173",
@@ -74,76 +193,426 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=ALLOWED_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["Authorization", "Content-Type"],
 )
 
+# The year of prices on /api/stocks is ~40 KB of repetitive JSON
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
+
+@app.exception_handler(PoolTimeout)
+async def pool_timeout_handler(request: Request, exc: PoolTimeout):
+    # Every connection is busy: shed load instead of queueing indefinitely
+    return ORJSONResponse(
+        status_code=503,
+        content={"detail": "Database busy, retry shortly"},
+        headers={"Retry-After": "1"},
+    )
+
 # --------------------------------------------------
 # ML MODEL
 # --------------------------------------------------
 MODEL_PATH = os.path.join(os.path.dirname(__file__), "ml_model", "stock_predictor.joblib")
+FEATURE_COLUMNS = ("open", "high", "low", "close", "volume")
 model = None
+_model_predict = None
 
 try:
     model = joblib.load(MODEL_PATH)
-    print("✓ ML model loaded")
+    # Single-row inference: spinning up a worker-thread team costs more than it saves
+    if "n_jobs" in model.get_params():
+        model.set_params(n_jobs=1)
+    FEATURE_COLUMNS = tuple(getattr(model, "feature_names_in_", FEATURE_COLUMNS))
+    # LightGBM: call the booster directly and skip the sklearn wrapper's per-call input
+    # validation. It still uses the best iteration; num_threads mirrors n_jobs=1 above.
+    booster = getattr(model, "booster_", None)
+    _model_predict = functools.partial(booster.predict, num_threads=1) if booster is not None else model.predict
+    log.info("✓ ML model loaded")
 except Exception as e:
-    print("⚠️ ML model failed to load:", e)
+    log.warning("⚠️ ML model failed to load: %s", e)
+
+_feature_buf = threading.local()
+
+
+def _predict_row(latest: dict) -> float:
+    # Runs in a worker thread; each thread fills its own preallocated (1, n) input
+    row = getattr(_feature_buf, "row", None)
+    if row is None:
+        row = _feature_buf.row = np.empty((1, len(FEATURE_COLUMNS)), dtype=np.float64)
+    for i, k in enumerate(FEATURE_COLUMNS):
+        row[0, i] = latest[k]
+    return float(_model_predict(row)[0])
+
+
+def _predict_rows(rows: list[dict]) -> list[float]:
+    # One model call for the whole batch instead of one per symbol
+    if len(rows) == 1:
+        return [_predict_row(rows[0])]
+    features = np.array([[r[k] for k in FEATURE_COLUMNS] for r in rows], dtype=np.float64)
+    return _model_predict(features).tolist()
+
+
+# Concurrent /api/predict misses that arrive within the window share one model call
+PREDICT_COALESCE_WINDOW_SEC = float(os.getenv("PREDICT_COALESCE_WINDOW_SEC", "0.005"))
+PREDICT_COALESCE_MAX = 64
+_pending_predictions: list[tuple[dict, asyncio.Future]] = []
+_predict_timer: asyncio.TimerHandle | None = None
+_prediction_batches: set[asyncio.Task] = set()
+
+
+async def _run_prediction_batch(batch: list[tuple[dict, asyncio.Future]]) -> None:
+    try:
+        values = await asyncio.to_thread(_predict_rows, [latest for latest, _ in batch])
+    except Exception as e:
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+        return
+    for (_, future), value in zip(batch, values):
+        if not future.done():  # the request may have been cancelled meanwhile
+            future.set_result(value)
+
+
+def _flush_predictions() -> None:
+    global _predict_timer
+    if _predict_timer is not None:
+        _predict_timer.cancel()
+        _predict_timer = None
+    batch = _pending_predictions[:]
+    _pending_predictions.clear()
+    if batch:
+        task = asyncio.create_task(_run_prediction_batch(batch))
+        _prediction_batches.add(task)
+        task.add_done_callback(_prediction_batches.discard)
+
+
+async def _coalesced_predict(latest: dict) -> float:
+    global _predict_timer
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    _pending_predictions.append((latest, future))
+    if len(_pending_predictions) >= PREDICT_COALESCE_MAX:
+        _flush_predictions()
+    elif _predict_timer is None:
+        _predict_timer = loop.call_later(PREDICT_COALESCE_WINDOW_SEC, _flush_predictions)
+    return await future
 
 # --------------------------------------------------
-# DATA HELPERS
+# RESPONSE CACHE
 # --------------------------------------------------
-def query_stock_data(term: str, conn: psycopg.Connection):
-    with conn.cursor() as cur:
-        cur.execute(
-            """
-            SELECT id, symbol, company_name
-            FROM stocks
-            WHERE symbol ILIKE %s OR company_name ILIKE %s
-            """,
-            (f"%{term}%", f"%{term}%"),
-        )
-        row = cur.fetchone()
-        if not row:
+# Prices only change when the data pipeline runs, so short-lived copies are safe.
+STOCK_CACHE_TTL_SEC = float(os.getenv("STOCK_CACHE_TTL_SEC", "900"))
+LIVE_CACHE_TTL_SEC = float(os.getenv("LIVE_CACHE_TTL_SEC", "30"))
+LIVE_REFRESH_SEC = float(os.getenv("LIVE_REFRESH_SEC", "15"))
+STOCK_REDIS_TTL_SEC = int(os.getenv("STOCK_REDIS_TTL_SEC", "21600"))
+SYMBOLS_CACHE_TTL_SEC = float(os.getenv("SYMBOLS_CACHE_TTL_SEC", "300"))
+HOT_SYMBOLS_MAX = 200
+
+
+class _TTLCache:
+    """Bounded in-process cache; entries expire after `ttl` seconds, oldest evicted first."""
+
+    def __init__(self, ttl: float, maxsize: int = 1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: dict = {}
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
             return None
+        expires, value = entry
+        if expires < time.monotonic():
+            self._data.pop(key, None)
+            return None
+        return value
+
+    def set(self, key, value):
+        self._data.pop(key, None)
+        if len(self._data) >= self.maxsize:
+            self._data.pop(next(iter(self._data)))
+        self._data[key] = (time.monotonic() + self.ttl, value)
+
+
+_stock_cache = _TTLCache(STOCK_CACHE_TTL_SEC)
+_live_cache = _TTLCache(LIVE_CACHE_TTL_SEC)
+# Keyed on the exact feature row, so a hit is always the answer the model would give
+_prediction_cache = _TTLCache(STOCK_CACHE_TTL_SEC)
+# Single entry: the encoded /api/symbols list and its ETag
+_symbols_cache = _TTLCache(SYMBOLS_CACHE_TTL_SEC, maxsize=1)
+
+# Symbol -> time of its last request, oldest first. The background refresher keeps these
+# warm; symbols not requested within LIVE_CACHE_TTL_SEC drop out and their entries expire.
+_hot_symbols: dict[str, float] = {}
+
+
+def _mark_hot(symbol: str) -> None:
+    _hot_symbols.pop(symbol, None)
+    _hot_symbols[symbol] = time.monotonic()
+    if len(_hot_symbols) > HOT_SYMBOLS_MAX:
+        _hot_symbols.pop(next(iter(_hot_symbols)))
+
+
+def _expire_hot_symbols() -> None:
+    # A symbol stays hot only while it keeps being requested within the live TTL
+    cutoff = time.monotonic() - LIVE_CACHE_TTL_SEC
+    while _hot_symbols:
+        oldest = next(iter(_hot_symbols))
+        if _hot_symbols[oldest] >= cutoff:
+            break
+        del _hot_symbols[oldest]
+
+
+STOCK_CACHE_CONTROL = "private, max-age=60"
+
+# Second tier behind _stock_cache and _live_cache, shared by every worker. The data pipeline
+# clears the stocks:* keys after each run; live:* entries expire after LIVE_CACHE_TTL_SEC.
+redis_client = (
+    aioredis.from_url(
+        REDIS_URL,
+        socket_connect_timeout=REDIS_TIMEOUT_SEC,
+        socket_timeout=REDIS_TIMEOUT_SEC,
+    )
+    if REDIS_URL
+    else None
+)
 
-        stock_id, symbol, name = row
 
-        cur.execute(
-            """
+async def _shared_get_stock(key: str):
+    if redis_client is None:
+        return None
+    try:
+        body, etag = await redis_client.hmget(f"stocks:{key}", "body", "etag")
+    except Exception as e:
+        log.warning("Redis read error: %s", e)
+        return None
+    if body is None or etag is None:
+        return None
+    return body, etag.decode()
+
+
+async def _shared_set_stock(key: str, cached: tuple) -> None:
+    if redis_client is None:
+        return
+    body, etag = cached
+    try:
+        async with redis_client.pipeline() as pipe:
+            pipe.hset(f"stocks:{key}", mapping={"body": body, "etag": etag})
+            pipe.expire(f"stocks:{key}", STOCK_REDIS_TTL_SEC)
+            await pipe.execute()
+    except Exception as e:
+        log.warning("Redis write error: %s", e)
+
+
+async def _shared_get_live(key: str):
+    if redis_client is None:
+        return None
+    try:
+        raw = await redis_client.get(f"live:{key}")
+    except Exception as e:
+        log.warning("Redis read error: %s", e)
+        return None
+    return orjson.loads(raw) if raw is not None else None
+
+
+async def _shared_set_live(key: str, info: dict) -> None:
+    if redis_client is None:
+        return
+    try:
+        await redis_client.set(f"live:{key}", orjson.dumps(info), ex=int(LIVE_CACHE_TTL_SEC))
+    except Exception as e:
+        log.warning("Redis write error: %s", e)
+
+# Cache misses currently being loaded; concurrent requests for the same key share one load
+_in_flight: dict[str, asyncio.Task] = {}
+
+
+def _finish_flight(key: str, task: asyncio.Task) -> None:
+    if _in_flight.get(key) is task:
+        del _in_flight[key]
+    if not task.cancelled():
+        task.exception()  # mark retrieved so a failure nobody waited on isn't logged
+
+
+async def _single_flight(key: str, load):
+    # The load runs as its own task that every caller (the first one included) only
+    # shields, so a disconnecting client can't cancel the result others are waiting on
+    task = _in_flight.get(key)
+    if task is None:
+        task = asyncio.create_task(load())
+        _in_flight[key] = task
+        task.add_done_callback(lambda t: _finish_flight(key, t))
+    return await asyncio.shield(task)
+
+
+def _body_etag(body: bytes) -> str:
+    # Hash the uncompressed body; weak, since GZipMiddleware may serve different bytes for it
+    return f'W/"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    # If-None-Match uses weak comparison (RFC 9110), so W/ is ignored on both sides
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    opaque = etag.removeprefix("W/")
+    return any(t.strip().removeprefix("W/") in (opaque, "*") for t in header.split(","))
+
+# --------------------------------------------------
+# DATA HELPERS
+# --------------------------------------------------
+# Stock lookups shared by the queries below: exact ticker, or ticker-or-company-name search.
+# NSE tickers are stored as XXX.NS, so a bare "TCS" also tries "TCS.NS" (exact match wins).
+_LOOKUP_BY_SYMBOL = """
+    SELECT id, symbol, company_name
+    FROM stocks
+    WHERE symbol IN (%(symbol)s, %(ns_symbol)s)
+    ORDER BY symbol = %(symbol)s DESC
+    LIMIT 1
+"""
+# Fallback: ticker prefix (HDFC -> HDFCBANK.NS, via the varchar_pattern_ops index) or company
+# name substring (trigram index); exact and .NS tickers first, then the shortest symbol
+_LOOKUP_BY_NAME = """
+    SELECT id, symbol, company_name
+    FROM stocks
+    WHERE symbol LIKE %(prefix)s OR company_name ILIKE %(pattern)s
+    ORDER BY symbol = %(symbol)s DESC,
+             symbol = %(ns_symbol)s DESC,
+             symbol LIKE %(prefix)s DESC,
+             length(symbol)
+    LIMIT 1
+"""
+
+# Resolve the stock and pull its recent prices in one statement; {lookup} picks the stock row.
+# Postgres builds the price list as one JSON array, so Python never loops over the rows.
+_STOCK_HISTORY_SQL = """
+    SELECT s.symbol, s.company_name, p.prices
+    FROM ({lookup}) s
+    CROSS JOIN LATERAL (
+        SELECT COALESCE(
+            json_agg(json_build_object(
+                'date', date,
+                'open', open::float8,
+                'high', high::float8,
+                'low', low::float8,
+                'close', close::float8,
+                'volume', volume
+            ) ORDER BY date DESC),
+            '[]'::json
+        ) AS prices
+        FROM (
             SELECT date, open, high, low, close, volume
             FROM stock_prices
-            WHERE stock_id=%s
+            WHERE stock_id = s.id
             ORDER BY date DESC
             LIMIT 365
-            """,
-            (stock_id,),
-        )
+        ) recent
+    ) p
+"""
+STOCK_BY_SYMBOL_SQL = _STOCK_HISTORY_SQL.format(lookup=_LOOKUP_BY_SYMBOL)
+STOCK_BY_NAME_SQL = _STOCK_HISTORY_SQL.format(lookup=_LOOKUP_BY_NAME)
+
+# Only the newest row: the model's input features
+# LEFT JOIN so a ticker with no prices still comes back (with NULL features) and the
+# caller doesn't fall through to the name search and answer for a different stock
+_LATEST_FEATURES_SQL = """
+    SELECT s.symbol, p.open, p.high, p.low, p.close, p.volume
+    FROM ({lookup}) s
+    LEFT JOIN LATERAL (
+        SELECT open, high, low, close, volume
+        FROM stock_prices
+        WHERE stock_id = s.id
+        ORDER BY date DESC
+        LIMIT 1
+    ) p ON true
+"""
+LATEST_BY_SYMBOL_SQL = _LATEST_FEATURES_SQL.format(lookup=_LOOKUP_BY_SYMBOL)
+LATEST_BY_NAME_SQL = _LATEST_FEATURES_SQL.format(lookup=_LOOKUP_BY_NAME)
+LATEST_BY_SYMBOLS_SQL = _LATEST_FEATURES_SQL.format(lookup="""
+    SELECT id, symbol, company_name
+    FROM stocks
+    WHERE symbol = ANY(%(symbols)s)
+""")
+
+PREDICT_BATCH_MAX = 50
+
+# Terms shaped like a ticker (AAPL, BRK-B, M&M.NS, TCS, ^NSEI) try the btree equality path first
+SYMBOL_RE = re.compile(r"^[\^A-Za-z0-9.&-]{1,30}$")
+
+
+async def _fetch_for_term(
+    term: str,
+    conn: psycopg.AsyncConnection,
+    by_symbol_sql: str,
+    by_name_sql: str,
+):
+    symbol = term.upper()
+    escaped = symbol.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    # Every placeholder is compared directly against a column, never concatenated in SQL,
+    # so Postgres deduces one type per parameter
+    params = {
+        "symbol": symbol,
+        "ns_symbol": f"{symbol}.NS",
+        "prefix": f"{escaped}%",
+        "pattern": f"%{term}%",
+    }
+    async with conn.cursor() as cur:
+        rows = None
+        if SYMBOL_RE.match(term):
+            await cur.execute(by_symbol_sql, params, prepare=PREPARE_HOT)
+            rows = await cur.fetchall()
+        if not rows:
+            await cur.execute(by_name_sql, params, prepare=PREPARE_HOT)
+            rows = await cur.fetchall()
+    return rows
+
+
+async def query_stock_data(term: str, conn: psycopg.AsyncConnection):
+    rows = await _fetch_for_term(term, conn, STOCK_BY_SYMBOL_SQL, STOCK_BY_NAME_SQL)
+    if not rows:
+        return None
+
+    symbol, name, prices = rows[0]
+    return {"symbol": symbol, "company_name": name, "prices": prices}
+
+
+async def query_latest_features(term: str, conn: psycopg.AsyncConnection):
+    rows = await _fetch_for_term(term, conn, LATEST_BY_SYMBOL_SQL, LATEST_BY_NAME_SQL)
+    if not rows:
+        return None
+    symbol, *values = rows[0]
+    if values[3] is None:
+        return None
+    return symbol, dict(zip(("open", "high", "low", "close", "volume"), values))
+
 
-        prices = cur.fetchall()
-
-        return {
-            "symbol": symbol,
-            "company_name": name,
-            "prices": [
-                {
-                    "date": r[0].isoformat(),
-                    "open": float(r[1]),
-                    "high": float(r[2]),
-                    "low": float(r[3]),
-                    "close": float(r[4]),
-                    "volume": int(r[5]),
-                }
-                for r in prices
-            ],
-        }
-
-
-def get_live_info(symbol: str, conn: psycopg.Connection):
-    with conn.cursor() as cur:
-        cur.execute(
+async def query_latest_features_many(symbols: list[str], conn: psycopg.AsyncConnection) -> dict:
+    async with conn.cursor() as cur:
+        await cur.execute(LATEST_BY_SYMBOLS_SQL, {"symbols": symbols}, prepare=PREPARE_HOT)
+        rows = await cur.fetchall()
+    return {
+        r[0]: dict(zip(("open", "high", "low", "close", "volume"), r[1:]))
+        for r in rows
+        if r[4] is not None
+    }
+
+
+def _live_info(close, high, low) -> dict:
+    return {
+        "currentPrice": close,
+        "dayHigh": high,
+        "dayLow": low,
+        "marketCap": None,
+        "source": "database",
+    }
+
+
+async def get_live_info(symbol: str, conn: psycopg.AsyncConnection):
+    async with conn.cursor() as cur:
+        await cur.execute(
             """
-            SELECT sp.close, sp.high, sp.low, s.company_name
+            SELECT sp.close, sp.high, sp.low
             FROM stock_prices sp
             JOIN stocks s ON s.id = sp.stock_id
             WHERE s.symbol = %s
@@ -151,51 +620,133 @@ def get_live_info(symbol: str, conn: psycopg.Connection):
             LIMIT 1
             """,
             (symbol.upper(),),
+            prepare=PREPARE_HOT,
         )
-        row = cur.fetchone()
+        row = await cur.fetchone()
 
     if not row:
         return None
+    return _live_info(*row)
 
-    close, high, low, name = row
-    return {
-        "currentPrice": float(close),
-        "dayHigh": float(high),
-        "dayLow": float(low),
-        "marketCap": None,
-        "source": "database",
-    }
+
+async def get_live_info_many(symbols: list[str], conn: psycopg.AsyncConnection) -> dict:
+    async with conn.cursor() as cur:
+        await cur.execute(
+            """
+            SELECT s.symbol, p.close, p.high, p.low
+            FROM stocks s
+            CROSS JOIN LATERAL (
+                SELECT close, high, low
+                FROM stock_prices
+                WHERE stock_id = s.id
+                ORDER BY date DESC
+                LIMIT 1
+            ) p
+            WHERE s.symbol = ANY(%s)
+            """,
+            (symbols,),
+            prepare=PREPARE_HOT,
+        )
+        return {r[0]: _live_info(*r[1:]) for r in await cur.fetchall()}
+
+
+async def cached_live_info(symbol: str):
+    # Only checks a connection out of the pool on a cache miss
+    key = symbol.upper()
+    info = _live_cache.get(key)
+    if info is None:
+        info = await _shared_get_live(key)
+        if info is None:
+            info = await run_query(lambda conn: get_live_info(key, conn))
+            if not info:
+                return None
+            await _shared_set_live(key, info)
+        _live_cache.set(key, info)
+    _mark_hot(key)
+    return info
+
+
+def _remember_live_info(symbol: str, latest: dict) -> dict:
+    # Live info is the newest price row; callers that already hold it skip the lookup
+    info = _live_info(latest["close"], latest["high"], latest["low"])
+    _live_cache.set(symbol, info)
+    _mark_hot(symbol)
+    return info
+
+
+async def _refresh_live_cache():
+    # One batched query per tick instead of one query per request for popular symbols
+    while True:
+        await asyncio.sleep(LIVE_REFRESH_SEC)
+        _expire_hot_symbols()
+        if not _hot_symbols:
+            continue
+        try:
+            symbols = list(_hot_symbols)
+            infos = await run_query(lambda conn: get_live_info_many(symbols, conn))
+            for symbol, info in infos.items():
+                _live_cache.set(symbol, info)
+        except Exception as e:
+            log.error("Live refresh error: %s", e)
+
+
+async def load_stock(term: str):
+    key = term.upper()
+    cached = await _shared_get_stock(key)
+    if cached is not None:
+        _stock_cache.set(key, cached)
+        return cached
+
+    try:
+        data = await run_query(lambda conn: query_stock_data(term, conn))
+    except PoolTimeout:
+        raise
+    except Exception as e:
+        log.error("ERROR /api/stocks: %s", e)
+        raise HTTPException(status_code=500, detail="Internal server error")
+    if not data:
+        raise HTTPException(status_code=404, detail="Stock not found")
+
+    if data["prices"]:
+        data["live_info"] = _remember_live_info(data["symbol"], data["prices"][0])
+
+    # Cache the encoded body so hits skip serialization entirely
+    body = orjson.dumps(data)
+    cached = (body, _body_etag(body))
+    _stock_cache.set(key, cached)
+    await _shared_set_stock(key, cached)
+    return cached
 
 
 # --------------------------------------------------
 # ROUTES
 # --------------------------------------------------
+# Liveness probes hit these constantly; encode the bodies once
+_ROOT_BODY = orjson.dumps({"status": "ok", "service": "Stock Predictor API"})
+_HEALTH_OK_BODY = orjson.dumps({"ok": True})
+
+
 @app.get("/")
-def root():
-    return {"status": "ok", "service": "Stock Predictor API"}
+async def root():
+    return Response(_ROOT_BODY, media_type="application/json")
 
 
 @app.get("/api/stocks/{term}")
-def get_stock(term: str, conn: psycopg.Connection = Depends(get_db_connection)):
-    try:
-        data = query_stock_data(term, conn)
-        if not data:
-            raise HTTPException(status_code=404, detail="Stock not found")
+async def get_stock(term: str, request: Request):
+    key = term.upper()
+    cached = _stock_cache.get(key)
+    if cached is None:
+        cached = await _single_flight(key, lambda: load_stock(term))
 
-        live = get_live_info(data["symbol"], conn)
-        if live:
-            data["live_info"] = live
-
-        return data
-    except HTTPException:
-        raise
-    except Exception as e:
-        print("ERROR /api/stocks:", e)
-        raise HTTPException(status_code=500, detail="Internal server error")
+    body, etag = cached
+    headers = {"ETag": etag, "Cache-Control": STOCK_CACHE_CONTROL}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
 
 
 @app.post("/api/predict")
-def predict(payload: dict, conn: psycopg.Connection = Depends(get_db_connection)):
+async def predict(payload: dict):
     if model is None:
         raise HTTPException(status_code=503, detail="Model not available")
 
@@ -203,20 +754,23 @@ def predict(payload: dict, conn: psycopg.Connection = Depends(get_db_connection)
     if not symbol:
         raise HTTPException(status_code=400, detail="symbol is required")
 
-    data = query_stock_data(symbol, conn)
-    if not data or not data["prices"]:
+    # Hand the connection back before inference; the model only needs the fetched row
+    found = await run_query(lambda conn: query_latest_features(symbol, conn))
+    if not found:
         raise HTTPException(status_code=404, detail="No historical data")
 
-    latest = data["prices"][0]
-    features = np.array([[latest[k] for k in ("open", "high", "low", "close", "volume")]])
+    stock_symbol, latest = found
+    cache_key = (stock_symbol, *(latest[k] for k in FEATURE_COLUMNS))
+    prediction = _prediction_cache.get(cache_key)
+    if prediction is None:
+        try:
+            prediction = await _coalesced_predict(latest)
+        except Exception as e:
+            log.error("Prediction error: %s", e)
+            raise HTTPException(status_code=500, detail="Prediction failed")
+        _prediction_cache.set(cache_key, prediction)
 
-    try:
-        prediction = float(model.predict(features)[0])
-    except Exception as e:
-        print("Prediction error:", e)
-        raise HTTPException(status_code=500, detail="Prediction failed")
-
-    live = get_live_info(symbol, conn)
+    live = _remember_live_info(stock_symbol, latest)
 
     return {
         "symbol": symbol.upper(),
@@ -225,29 +779,96 @@ def predict(payload: dict, conn: psycopg.Connection = Depends(get_db_connection)
     }
 
 
+@app.post("/api/predict_batch")
+async def predict_batch(payload: dict):
+    if model is None:
+        raise HTTPException(status_code=503, detail="Model not available")
+
+    symbols = payload.get("symbols")
+    if not isinstance(symbols, list) or not symbols:
+        raise HTTPException(status_code=400, detail="symbols must be a non-empty list")
+    if len(symbols) > PREDICT_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {PREDICT_BATCH_MAX} symbols per request")
+    symbols = list(dict.fromkeys(str(s).upper() for s in symbols))
+
+    latest_by_symbol = await run_query(lambda conn: query_latest_features_many(symbols, conn))
+
+    predictions = {}
+    misses = []
+    for symbol, latest in latest_by_symbol.items():
+        cache_key = (symbol, *(latest[k] for k in FEATURE_COLUMNS))
+        prediction = _prediction_cache.get(cache_key)
+        if prediction is None:
+            misses.append((symbol, cache_key, latest))
+        else:
+            predictions[symbol] = prediction
+
+    if misses:
+        try:
+            values = await asyncio.to_thread(_predict_rows, [m[2] for m in misses])
+        except Exception as e:
+            log.error("Prediction error: %s", e)
+            raise HTTPException(status_code=500, detail="Prediction failed")
+        for (symbol, cache_key, _), prediction in zip(misses, values):
+            _prediction_cache.set(cache_key, prediction)
+            predictions[symbol] = prediction
+
+    return {
+        "predictions": {
+            symbol: {
+                "predicted_next_day_close": predictions[symbol],
+                "live_info": _remember_live_info(symbol, latest_by_symbol[symbol]),
+            }
+            for symbol in symbols
+            if symbol in predictions
+        },
+        "not_found": [s for s in symbols if s not in predictions],
+    }
+
+
 @app.get("/api/live/{symbol}")
-def live(symbol: str, conn: psycopg.Connection = Depends(get_db_connection)):
-    info = get_live_info(symbol, conn)
+async def live(symbol: str):
+    info = await cached_live_info(symbol)
     if not info:
         raise HTTPException(status_code=404, detail="No live data")
     return {"symbol": symbol.upper(), "live_info": info}
 
 
+async def query_symbols(conn: psycopg.AsyncConnection):
+    async with conn.cursor() as cur:
+        await cur.execute("SELECT symbol FROM stocks ORDER BY symbol")
+        return await cur.fetchall()
+
+
+async def load_symbols():
+    rows = await run_query(query_symbols)
+    body = orjson.dumps([r[0] for r in rows])
+    cached = (body, _body_etag(body))
+    _symbols_cache.set("symbols", cached)
+    return cached
+
+
 @app.get("/api/symbols")
-def symbols(conn: psycopg.Connection = Depends(get_db_connection)):
-    with conn.cursor() as cur:
-        cur.execute("SELECT symbol FROM stocks ORDER BY symbol")
-        return [r[0] for r in cur.fetchall()]
+async def symbols(request: Request):
+    cached = _symbols_cache.get("symbols")
+    if cached is None:
+        cached = await _single_flight("/api/symbols", load_symbols)
+
+    body, etag = cached
+    headers = {"ETag": etag, "Cache-Control": STOCK_CACHE_CONTROL}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
 
 
 @app.get("/health/db")
-def health_db(conn: psycopg.Connection = Depends(get_db_connection)):
+async def health_db(conn: psycopg.AsyncConnection = Depends(get_db_connection)):
     try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT 1")
-        return {"ok": True}
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT 1")
+        return Response(_HEALTH_OK_BODY, media_type="application/json")
     except Exception as e:
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=500,
             content={"ok": False, "error": e.__class__.__name__},
         )
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The API runs from backend/ (uvicorn main:app), so tests import it the same way
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,102 @@
+"""Runs the stock lookup SQL against a real Postgres.
+
+Parameter type deduction and index/ordering behaviour only show up on a real server,
+so these tests need TEST_DATABASE_URL (any scratch database; only temp tables are used).
+"""
+import asyncio
+import os
+
+import pytest
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+if not TEST_DATABASE_URL:
+    pytest.skip("set TEST_DATABASE_URL to run against Postgres", allow_module_level=True)
+
+os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+psycopg = pytest.importorskip("psycopg")
+
+import main  # noqa: E402
+
+# Temp tables shadow any real ones for this connection and vanish when it closes
+SCHEMA = """
+    CREATE TEMP TABLE stocks (
+        id SERIAL PRIMARY KEY,
+        symbol VARCHAR(30) UNIQUE NOT NULL,
+        company_name VARCHAR(100),
+        sector VARCHAR(50)
+    );
+    CREATE TEMP TABLE stock_prices (
+        id SERIAL PRIMARY KEY,
+        stock_id INT REFERENCES stocks(id),
+        date DATE NOT NULL,
+        open NUMERIC,
+        high NUMERIC,
+        low NUMERIC,
+        close NUMERIC,
+        volume BIGINT,
+        UNIQUE (stock_id, date)
+    );
+    INSERT INTO stocks (symbol, company_name) VALUES
+        ('AAPL', 'Apple Inc.'),
+        ('TCS.NS', 'Tata Consultancy Services'),
+        ('HDFCBANK.NS', 'HDFC Bank'),
+        ('NOPX', 'No Prices Corp'),
+        ('NOPXA', 'Nopxa Holdings');
+    INSERT INTO stock_prices (stock_id, date, open, high, low, close, volume)
+    SELECT s.id, d::date, 10, 12, 9, 11 + extract(day FROM d), 1000
+    FROM stocks s
+    CROSS JOIN generate_series('2024-01-01'::date, '2024-01-05'::date, '1 day') d
+    WHERE s.symbol <> 'NOPX';
+"""
+
+
+def run(query):
+    async def go():
+        conn = await psycopg.AsyncConnection.connect(TEST_DATABASE_URL)
+        try:
+            await main._configure_connection(conn)
+            await conn.execute(SCHEMA)
+            return await query(conn)
+        finally:
+            await conn.close()
+
+    return asyncio.run(go())
+
+
+@pytest.mark.parametrize(
+    "term, symbol",
+    [
+        ("AAPL", "AAPL"),
+        ("aapl", "AAPL"),
+        ("TCS", "TCS.NS"),
+        ("TCS.NS", "TCS.NS"),
+        ("HDFC", "HDFCBANK.NS"),
+        ("Apple", "AAPL"),
+        ("consultancy", "TCS.NS"),
+    ],
+)
+def test_stock_history_resolves_term(term, symbol):
+    data = run(lambda conn: main.query_stock_data(term, conn))
+    assert data["symbol"] == symbol
+    dates = [p["date"] for p in data["prices"]]
+    assert dates == sorted(dates, reverse=True) and len(dates) == 5
+
+
+def test_unknown_term_is_not_found():
+    assert run(lambda conn: main.query_stock_data("ZZZZ", conn)) is None
+
+
+def test_latest_features_for_bare_nse_ticker():
+    symbol, latest = run(lambda conn: main.query_latest_features("TCS", conn))
+    assert symbol == "TCS.NS"
+    assert latest["close"] == 16.0
+
+
+def test_ticker_without_prices_is_not_answered_by_another_stock():
+    # NOPX exists but has no prices; the name search would otherwise pick NOPXA
+    assert run(lambda conn: main.query_latest_features("NOPX", conn)) is None
+
+
+def test_latest_features_many_skips_tickers_without_prices():
+    latest = run(lambda conn: main.query_latest_features_many(["AAPL", "NOPX", "ZZZZ"], conn))
+    assert set(latest) == {"AAPL"}
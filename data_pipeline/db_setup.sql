@@ -1,3 +1,5 @@
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 CREATE TABLE stocks (
     id SERIAL PRIMARY KEY,
     symbol VARCHAR(30) UNIQUE NOT NULL,
@@ -5,6 +7,11 @@ CREATE TABLE stocks (
     sector VARCHAR(50)
 );
 
+-- Substring search on company names for /api/stocks/{term}
+CREATE INDEX idx_stocks_company_name_trgm ON stocks USING gin (company_name gin_trgm_ops);
+-- Ticker prefix search (HDFC -> HDFCBANK.NS); the UNIQUE btree can't serve LIKE 'x%'
+CREATE INDEX idx_stocks_symbol_pattern ON stocks (symbol varchar_pattern_ops);
+
 CREATE TABLE stock_prices (
     id SERIAL PRIMARY KEY,
     stock_id INT REFERENCES stocks(id),
@@ -17,6 +24,10 @@ CREATE TABLE stock_prices (
     UNIQUE (stock_id, date)
 );
 
+-- Lets the API's latest-N-prices read run as an index-only scan
+CREATE INDEX idx_stock_prices_stock_date_covering
+    ON stock_prices (stock_id, date DESC) INCLUDE (open, high, low, close, volume);
+
 CREATE TABLE users (
     id SERIAL PRIMARY KEY,
     username VARCHAR(50) UNIQUE NOT NULL,
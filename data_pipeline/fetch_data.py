@@ -1,14 +1,20 @@
 import os
+import json
 import psycopg
+from psycopg_pool import ConnectionPool
 import yfinance as yf
 import pandas as pd
+import numpy as np
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 from io import StringIO # <-- Add StringIO
 import time
 import requests
+import redis
 import logging
 import threading
+import math
+from itertools import repeat
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # -------------------------------------------------------------------------
@@ -16,6 +22,7 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 # -------------------------------------------------------------------------
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
+REDIS_URL = os.getenv("REDIS_URL")
 
 # Logging (instead of print → better for production)
 logging.basicConfig(
@@ -25,10 +32,50 @@ logging.basicConfig(
 )
 
 RATE_LIMIT_SEC = float(os.getenv("YF_RATE_LIMIT_SEC", "0.5"))
-PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "1"))
+RATE_LIMIT_COOLDOWN_SEC = float(os.getenv("YF_RATE_LIMIT_COOLDOWN_SEC", "30"))
+# Upper bound on a server-sent Retry-After, so one odd header can't stall the whole run
+RATE_LIMIT_MAX_COOLDOWN_SEC = float(os.getenv("YF_RATE_LIMIT_MAX_COOLDOWN_SEC", "60"))
+# Yahoo calls stay spaced by RATE_LIMIT_SEC across all workers; extra workers overlap
+# the waits with parsing and DB writes for other symbols
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "4"))
+
+# Index constituent lists barely change; reuse a local copy instead of re-scraping every run
+SYMBOL_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+SYMBOL_CACHE_TTL_SEC = float(os.getenv("SYMBOL_CACHE_TTL_SEC", str(7 * 86400)))
+
+# One keep-alive session for every HTTP call, so TLS handshakes are paid once per host
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.headers["User-Agent"] = "Mozilla/5.0"
+HTTP_SESSION.mount(
+    "https://",
+    requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=max(PIPELINE_WORKERS, 10)),
+)
+HTTP_TIMEOUT_SEC = 30
+# An incremental fetch that stays empty this long past the last stored day is suspicious,
+# not just a weekend or holiday
+STALE_SYMBOL_DAYS = int(os.getenv("STALE_SYMBOL_DAYS", "7"))
 
 _YF_LOCK = threading.Lock()
+_POOL_LOCK = threading.Lock()
+_pool = None
 _last_call = 0.0
+# Per worker thread: Retry-After seconds of a Yahoo 429 seen during the current attempt
+_rate_limit_state = threading.local()
+
+def get_pool():
+    """Shared connections for the worker threads, opened on first use."""
+    global _pool
+    if _pool is None:
+        with _POOL_LOCK:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    DATABASE_URL,
+                    min_size=1,
+                    max_size=PIPELINE_WORKERS + 1,
+                    kwargs={"prepare_threshold": None},
+                    open=True,
+                )
+    return _pool
 
 def _rate_limit_wait():
     global _last_call
@@ -39,14 +86,50 @@ def _rate_limit_wait():
             time.sleep(delay)
         _last_call = time.time()
 
+def _retry_after(response):
+    """Seconds to back off after a 429 response, from Retry-After when Yahoo sends it."""
+    try:
+        seconds = float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        seconds = RATE_LIMIT_COOLDOWN_SEC
+    if not math.isfinite(seconds):
+        seconds = RATE_LIMIT_COOLDOWN_SEC
+    return min(max(seconds, 0.0), RATE_LIMIT_MAX_COOLDOWN_SEC)
+
+def _note_rate_limit(response, *args, **kwargs):
+    """Session hook: yfinance swallows HTTP errors and returns an empty frame,
+    so record 429s here where _with_backoff can see them."""
+    if response.status_code == 429:
+        _rate_limit_state.retry_after = _retry_after(response)
+    return response
+
+HTTP_SESSION.hooks["response"].append(_note_rate_limit)
+
+def _cooldown(seconds):
+    """Push the shared call window forward so every worker pauses, not just this one."""
+    global _last_call
+    with _YF_LOCK:
+        _last_call = max(_last_call, time.time() + seconds - RATE_LIMIT_SEC)
+
 def _with_backoff(fn, retries=4, base=0.75):
     for i in range(retries):
+        _rate_limit_state.retry_after = None
+        failed = False
         try:
             _rate_limit_wait()
-            return fn()
+            result = fn()
         except Exception:
-            if i == retries - 1:
-                return None
+            failed = True
+        wait = _rate_limit_state.retry_after
+        # A 429 on one of yfinance's side requests doesn't void data the call did return
+        if not failed and (wait is None or not getattr(result, "empty", False)):
+            return result
+        if i == retries - 1:
+            return None
+        if wait is not None:
+            logging.warning(f"⏳ Yahoo rate limit hit, pausing all fetches for {wait:.0f}s")
+            _cooldown(wait)
+        else:
             time.sleep(base * (2 ** i))
 
 # -------------------------------------------------------------------------
@@ -54,7 +137,7 @@ def _with_backoff(fn, retries=4, base=0.75):
 # -------------------------------------------------------------------------
 def create_tables_if_not_exist():
     try:
-        with psycopg.connect(DATABASE_URL) as conn:
+        with get_pool().connection() as conn:
             with conn.cursor() as cur:
                 cur.execute("""
                     CREATE TABLE IF NOT EXISTS stocks (
@@ -84,14 +167,88 @@ def create_tables_if_not_exist():
         logging.error(f"Error creating tables: {e}")
         return False
 
+# Search and read-path indexes for the API. Ingestion works without them, so each runs in its
+# own transaction and a failure (e.g. no privilege to create extensions) is only logged.
+OPTIONAL_DDL = (
+    ("pg_trgm extension", "CREATE EXTENSION IF NOT EXISTS pg_trgm"),
+    ("idx_stocks_company_name_trgm", """
+        CREATE INDEX IF NOT EXISTS idx_stocks_company_name_trgm
+        ON stocks USING gin (company_name gin_trgm_ops)
+    """),
+    ("idx_stocks_symbol_pattern", """
+        CREATE INDEX IF NOT EXISTS idx_stocks_symbol_pattern
+        ON stocks (symbol varchar_pattern_ops)
+    """),
+    ("idx_stock_prices_stock_date_covering", """
+        CREATE INDEX IF NOT EXISTS idx_stock_prices_stock_date_covering
+        ON stock_prices (stock_id, date DESC) INCLUDE (open, high, low, close, volume)
+    """),
+)
+
+def create_optional_indexes():
+    for name, ddl in OPTIONAL_DDL:
+        try:
+            with get_pool().connection() as conn:
+                conn.execute(ddl)
+        except Exception as e:
+            logging.warning(f"⚠️ Skipping {name}: {e}")
+
 # -------------------------------------------------------------------------
 # 🌐 NEW: Functions to fetch S&P 500 and NIFTY 500 stock lists
 # -------------------------------------------------------------------------
+def _read_stock_cache(path):
+    """Returns (fetched_at, stocks) from a cache file, or None if it's missing or malformed."""
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning(f"⚠️ Unreadable stock list cache {path}: {e}")
+        cached = None
+    try:
+        fetched_at, stocks = float(cached["fetched_at"]), cached["stocks"]
+        if not all(isinstance(c["symbol"], str) and isinstance(c["name"], str) for c in stocks):
+            raise ValueError("stock entries need string symbol and name")
+        return fetched_at, stocks
+    except (TypeError, KeyError, ValueError) as e:
+        if cached is not None:
+            logging.warning(f"⚠️ Discarding malformed stock list cache {path}: {e!r}")
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    return None
+
+def _cached_stock_list(name, fetch):
+    """Returns a cached stock list younger than SYMBOL_CACHE_TTL_SEC, else calls fetch()."""
+    path = os.path.join(SYMBOL_CACHE_DIR, f"{name}.json")
+    cached = _read_stock_cache(path)
+    if cached and time.time() - cached[0] < SYMBOL_CACHE_TTL_SEC:
+        logging.info(f"✅ Using cached {name} list ({len(cached[1])} stocks).")
+        return cached[1]
+
+    stocks = fetch()
+    if stocks:
+        try:
+            os.makedirs(SYMBOL_CACHE_DIR, exist_ok=True)
+            with open(path, "w") as f:
+                json.dump({"fetched_at": time.time(), "stocks": stocks}, f)
+        except OSError as e:
+            logging.warning(f"⚠️ Could not cache {name} list: {e}")
+    elif cached and cached[1]:
+        # Source unreachable: a stale list beats skipping the whole index
+        logging.warning(f"⚠️ Falling back to stale cached {name} list.")
+        return cached[1]
+    return stocks
+
 def get_sp500_stocks():
     """Fetches the list of S&P 500 companies from Wikipedia."""
     try:
         url = "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies"
-        html = requests.get(url, headers={'User-Agent': 'Mozilla/5.0'}).text
+        resp = HTTP_SESSION.get(url, timeout=HTTP_TIMEOUT_SEC)
+        resp.raise_for_status()
+        html = resp.text
         
         # --- FIX: Target the specific table by ID 'constituents' ---
         dfs = pd.read_html(StringIO(html), attrs={"id": "constituents"})
@@ -104,7 +261,7 @@ def get_sp500_stocks():
         df.rename(columns={'Ticker symbol': 'Symbol'}, inplace=True)
         
         df['Symbol'] = df['Symbol'].str.replace('.', '-', regex=False)
-        stocks = [{"symbol": row['Symbol'], "name": row['Security']} for _, row in df.iterrows()]
+        stocks = [{"symbol": s, "name": n} for s, n in zip(df['Symbol'], df['Security'])]
         logging.info(f"✅ Fetched {len(stocks)} S&P 500 stocks.")
         return stocks
     except Exception as e:
@@ -115,9 +272,11 @@ def get_nifty500_stocks():
     """Fetches the list of NIFTY 500 companies from a public CSV."""
     try:
         url = "https://archives.nseindia.com/content/indices/ind_nifty500list.csv"
-        df = pd.read_csv(url)
+        resp = HTTP_SESSION.get(url, timeout=HTTP_TIMEOUT_SEC)
+        resp.raise_for_status()
+        df = pd.read_csv(StringIO(resp.text))
         # Indian stocks need a '.NS' suffix for yfinance
-        stocks = [{"symbol": f"{row['Symbol']}.NS", "name": row['Company Name']} for _, row in df.iterrows()]
+        stocks = [{"symbol": f"{s}.NS", "name": n} for s, n in zip(df['Symbol'], df['Company Name'])]
         logging.info(f"✅ Fetched {len(stocks)} NIFTY 500 stocks.")
         return stocks
     except Exception as e:
@@ -126,8 +285,8 @@ def get_nifty500_stocks():
 
 def get_target_stocks():
     """Combines S&P 500 and NIFTY 500 lists."""
-    sp500 = get_sp500_stocks()
-    nifty500 = get_nifty500_stocks()
+    sp500 = _cached_stock_list("sp500", get_sp500_stocks)
+    nifty500 = _cached_stock_list("nifty500", get_nifty500_stocks)
     
     # Add a few major indexes as well
     indexes = [
@@ -147,16 +306,16 @@ def get_target_stocks():
 def get_latest_date(symbol):
     """Return the latest stored date for the given symbol."""
     try:
-        with psycopg.connect(DATABASE_URL) as conn:
+        with get_pool().connection() as conn:
             with conn.cursor() as cur:
-                cur.execute("SELECT id FROM stocks WHERE symbol=%s", (symbol,))
-                row = cur.fetchone()
-                if not row:
-                    return None
-                stock_id = row[0]
-                cur.execute("SELECT MAX(date) FROM stock_prices WHERE stock_id=%s", (stock_id,))
-                date_row = cur.fetchone()
-                return date_row[0]
+                # One round trip; NULL for unknown symbols and symbols without prices
+                cur.execute("""
+                    SELECT MAX(p.date)
+                    FROM stocks s
+                    JOIN stock_prices p ON p.stock_id = s.id
+                    WHERE s.symbol = %s
+                """, (symbol,))
+                return cur.fetchone()[0]
     except Exception as e:
         logging.error(f"Error checking latest date for {symbol}: {e}")
         return None
@@ -169,7 +328,7 @@ def fetch_stock_data(symbol, start_date=None):
     """Fetches historical data exclusively from Yahoo Finance."""
     try:
         # Use yfinance to fetch data. It's robust.
-        ticker = yf.Ticker(symbol)
+        ticker = yf.Ticker(symbol, session=HTTP_SESSION)
         
         # Fetch data from the start date. If no start date, get max history.
         data = _with_backoff(lambda: ticker.history(
@@ -180,12 +339,22 @@ def fetch_stock_data(symbol, start_date=None):
             auto_adjust=False # Important for raw OHLCV data
         ))
 
-        if data is None or data.empty:
-            # If that fails, try a shorter period as a fallback
+        if data is None and start_date is not None:
+            logging.warning(f"Incremental fetch for {symbol} from {start_date} failed after retries.")
+            return None
+
+        # An empty incremental fetch usually just means no new sessions (weekend/holiday);
+        # only fall back to a full year when there was no stored history to resume from.
+        if (data is None or data.empty) and start_date is None:
             data = _with_backoff(lambda: ticker.history(period="1y", interval="1d", auto_adjust=False))
 
         if data is None or data.empty:
-            logging.warning(f"No data found for {symbol} after retries.")
+            if start_date is None:
+                logging.warning(f"No data found for {symbol} after retries.")
+            elif (datetime.today().date() - start_date).days > STALE_SYMBOL_DAYS:
+                logging.warning(
+                    f"No new data for {symbol} since {start_date}; it may be delisted or renamed."
+                )
             return None
             
         return data
@@ -202,49 +371,103 @@ def store_stock_data(symbol, company_name, df):
     try:
         # --- FIX START: Filter out future dates before storing ---
         today = datetime.today().date()
-        df_filtered = df[df.index.date <= today]
+        dates = df.index.date  # one vectorized conversion, reused for the rows below
+        in_range = dates <= today
+        df_filtered = df[in_range]
+        dates = dates[in_range]
         if df_filtered.empty:
             logging.warning(f"⏩ Skipping store for {symbol}, all fetched data was in the future.")
             return
         # --- FIX END ---
 
-        with psycopg.connect(DATABASE_URL, prepare_threshold=None) as conn:
+        with get_pool().connection() as conn:
             with conn.cursor() as cur:
+                # Only rewrite the stocks row when the name actually changed (no dead
+                # tuple per symbol per run); the fallback SELECT covers the unchanged case
                 cur.execute("""
-                    INSERT INTO stocks (symbol, company_name)
-                    VALUES (%s, %s)
-                    ON CONFLICT (symbol) DO UPDATE SET company_name = EXCLUDED.company_name
-                    RETURNING id
-                """, (symbol, company_name))
-                stock_id = cur.fetchone()[0]
-                # Bulk insert for performance
-                rows = [
-                    (
-                        stock_id,
-                        date.date(),
-                        float(r["Open"]),
-                        float(r["High"]),
-                        float(r["Low"]),
-                        float(r["Close"]),
-                        int(r["Volume"]) if not pd.isna(r["Volume"]) else 0,
+                    WITH upserted AS (
+                        INSERT INTO stocks (symbol, company_name)
+                        VALUES (%(symbol)s, %(name)s)
+                        ON CONFLICT (symbol) DO UPDATE SET company_name = EXCLUDED.company_name
+                        WHERE stocks.company_name IS DISTINCT FROM EXCLUDED.company_name
+                        RETURNING id
                     )
-                    for date, r in df_filtered.iterrows()
-                ]
-                cur.executemany("""
+                    SELECT id FROM upserted
+                    UNION ALL
+                    SELECT id FROM stocks WHERE symbol = %(symbol)s
+                    LIMIT 1
+                """, {"symbol": symbol, "name": company_name})
+                stock_id = cur.fetchone()[0]
+                # Column-wise extraction; tolist() hands COPY plain Python floats/ints
+                opens, highs, lows, closes = (
+                    df_filtered[["Open", "High", "Low", "Close"]].to_numpy(dtype="float64").T.tolist()
+                )
+                volumes = np.nan_to_num(
+                    df_filtered["Volume"].to_numpy(dtype="float64"), nan=0
+                ).astype("int64").tolist()
+                # Rows are zipped lazily straight into COPY; no intermediate list of tuples
+                rows = zip(repeat(stock_id), dates, opens, highs, lows, closes, volumes)
+                # Bulk load: binary COPY into a staging table, then one upsert into stock_prices.
+                # Prices stage as float8 (what the rows hold) and are cast to NUMERIC on insert.
+                cur.execute("""
+                    CREATE TEMP TABLE stock_prices_stage (
+                        stock_id INT,
+                        date DATE,
+                        open DOUBLE PRECISION,
+                        high DOUBLE PRECISION,
+                        low DOUBLE PRECISION,
+                        close DOUBLE PRECISION,
+                        volume BIGINT
+                    ) ON COMMIT DROP
+                """)
+                with cur.copy(
+                    "COPY stock_prices_stage (stock_id, date, open, high, low, close, volume) "
+                    "FROM STDIN (FORMAT BINARY)"
+                ) as copy:
+                    copy.set_types(["int4", "date", "float8", "float8", "float8", "float8", "int8"])
+                    for row in rows:
+                        copy.write_row(row)
+                cur.execute("""
                     INSERT INTO stock_prices (stock_id, date, open, high, low, close, volume)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    SELECT stock_id, date, open, high, low, close, volume
+                    FROM stock_prices_stage
                     ON CONFLICT (stock_id, date) DO UPDATE
                       SET open = EXCLUDED.open,
                           high = EXCLUDED.high,
                           low = EXCLUDED.low,
                           close = EXCLUDED.close,
                           volume = EXCLUDED.volume
-                """, rows)
+                """)
             conn.commit()
         logging.info(f"💾 Stored {len(df_filtered)} records for {symbol}")
     except Exception as e:
         logging.error(f"Database error for {symbol}: {e}")
 
+def vacuum_prices():
+    """Refresh the visibility map and planner stats after a bulk load."""
+    # Upserted pages aren't all-visible until vacuumed, which forces the API's
+    # covering-index reads back to the heap. VACUUM can't run inside a transaction.
+    try:
+        with psycopg.connect(DATABASE_URL, autocommit=True) as conn:
+            conn.execute("VACUUM (ANALYZE) stock_prices")
+        logging.info("🧹 Vacuumed stock_prices")
+    except Exception as e:
+        logging.error(f"Error vacuuming stock_prices: {e}")
+
+def invalidate_api_cache():
+    """Drop the API's cached /api/stocks responses so new prices are served."""
+    if not REDIS_URL:
+        return
+    try:
+        client = redis.Redis.from_url(REDIS_URL, socket_connect_timeout=5, socket_timeout=5)
+        keys = list(client.scan_iter("stocks:*", count=500))
+        if keys:
+            client.unlink(*keys)
+        client.close()
+        logging.info(f"🧹 Cleared {len(keys)} cached API responses")
+    except Exception as e:
+        logging.error(f"Error clearing API cache: {e}")
+
 # -------------------------------------------------------------------------
 # 🚀 Main Execution (threaded)
 # -------------------------------------------------------------------------
@@ -284,16 +507,21 @@ def main():
     if not create_tables_if_not_exist():
         logging.error("❌ Database setup failed")
         return
+    create_optional_indexes()
 
     companies = get_target_stocks() # <-- Use the new function
     with ThreadPoolExecutor(max_workers=PIPELINE_WORKERS) as executor:
-        futures = [executor.submit(process_company, c) for c in companies]
+        futures = {executor.submit(process_company, c): c for c in companies}
         for i, f in enumerate(as_completed(futures), start=1):
+            symbol = futures[f]["symbol"]
             try:
                 f.result()
-                logging.info(f"✅ ({i}/{len(companies)}) Processed {companies[i-1]['symbol']}")
+                logging.info(f"✅ ({i}/{len(companies)}) Processed {symbol}")
             except Exception as e:
-                logging.error(f"Thread error: {e}")
+                logging.error(f"Thread error for {symbol}: {e}")
+    get_pool().close()
+    vacuum_prices()
+    invalidate_api_cache()
     logging.info("🎯 All stock data updated successfully!")
 
 if __name__ == "__main__":
@@ -1,5 +1,5 @@
 import os
-import sys
+import shutil
 import psycopg  
 import pandas as pd
 import numpy as np
@@ -11,12 +11,16 @@ from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
 import joblib
 from dotenv import load_dotenv
 
-# Allow importing from the root directory
-sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Output locations, resolved once: the training copy and the one the API loads
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.path.join(MODEL_DIR, 'stock_predictor.joblib')
+BACKEND_MODEL_DIR = os.path.join(MODEL_DIR, '..', 'backend', 'ml_model')
+BACKEND_MODEL_PATH = os.path.join(BACKEND_MODEL_DIR, 'stock_predictor.joblib')
+
 def train_and_save_model():
     """Fetches all data, trains a simple model, and saves it."""
     print("Connecting to database to fetch training data...")
@@ -85,16 +89,13 @@ def train_and_save_model():
     # --- FIX ENDS HERE ---
 
     # Save the trained model to a file
-    model_path = os.path.join(os.path.dirname(__file__), 'stock_predictor.joblib')
-    joblib.dump(model, model_path)
-    print(f"Model saved successfully to {model_path}")
+    joblib.dump(model, MODEL_PATH)
+    print(f"Model saved successfully to {MODEL_PATH}")
 
-    # Copy to backend/ml_model so the API uses the latest model
-    backend_model_dir = os.path.join(os.path.dirname(__file__), '..', 'backend', 'ml_model')
-    os.makedirs(backend_model_dir, exist_ok=True)
-    backend_model_path = os.path.join(backend_model_dir, 'stock_predictor.joblib')
-    joblib.dump(model, backend_model_path)
-    print(f"Model copied to {backend_model_path}")
+    # Copy to backend/ml_model so the API uses the latest model (a file copy, not a second pickle)
+    os.makedirs(BACKEND_MODEL_DIR, exist_ok=True)
+    shutil.copyfile(MODEL_PATH, BACKEND_MODEL_PATH)
+    print(f"Model copied to {BACKEND_MODEL_PATH}")
 
 if __name__ == "__main__":
     train_and_save_model()
\ No newline at end of file